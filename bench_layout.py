@@ -0,0 +1,55 @@
+# bench_layout.py
+# -------------------------------------------------------------
+# Benchmark del layout PDF: modo 'flow' (un Paragraph por viñeta)
+# frente a 'batched' (ExperienceBlock con medidas cacheadas).
+# Uso: python bench_layout.py [repeticiones]
+# -------------------------------------------------------------
+import sys
+import time
+
+import cv_generator as cvg
+
+BUILDERS = {
+    'classic': cvg.build_pdf_classic,
+    'twocol':  cvg.build_pdf_twocol,
+    'minimal': cvg.build_pdf_minimal,
+    'modern':  cvg.build_pdf_modern,
+}
+
+# (experiencias, viñetas por experiencia, frases por viñeta) para CVs de ~1, 3
+# y 10 páginas (clásica), dentro de los límites del esquema (40 puestos, 200
+# viñetas, 3000 caracteres por descripción)
+SIZES = {'1p': (2, 4, 1), '3p': (14, 5, 1), '10p': (40, 5, 3)}
+
+def make_data(n_exp: int, n_bullets: int, n_phrases: int) -> dict:
+    phrase = 'optimización de procesos y reducción de costes operativos'
+    bullet = lambda j: f'Logro {j}: ' + ', '.join([phrase] * n_phrases)
+    payload = {
+        'full_name': 'Alexis Galán', 'role': 'Data Analyst', 'email': 'alexis@example.com',
+        'summary': 'Analista de datos con 5+ años construyendo ETLs y dashboards.',
+        'skills': ['Python', 'SQL', 'Airflow', 'Pandas'],
+        'experiences': [{'title': f'Puesto {i}', 'company': f'Empresa {i}', 'dates': f'{2000 + i} – {2001 + i}',
+                         'desc': '; '.join(bullet(j) for j in range(n_bullets))} for i in range(n_exp)],
+        'education': [{'title': 'Grado en Estadística', 'school': 'UCM', 'dates': '2016 – 2020'}],
+    }
+    return cvg.cv_model(payload)  # lo mismo que aceptaría /api/generate (sin foto: sin red)
+
+def count_pages(pdf: bytes) -> int:
+    return pdf.count(b'/Type /Page') - pdf.count(b'/Type /Pages')
+
+def run(reps: int = 5):
+    print(f"{'plantilla':<9} {'tamaño':<6} {'modo':<8} {'págs':>5} {'ms/render':>10}")
+    for size, shape in SIZES.items():
+        data = make_data(*shape)
+        for tpl, build in BUILDERS.items():
+            for mode in ('flow', 'batched'):
+                cvg.LAYOUT_MODE = mode
+                pdf = build(data)  # calentamiento
+                t0 = time.perf_counter()
+                for _ in range(reps):
+                    build(data)
+                ms = (time.perf_counter() - t0) * 1000 / reps
+                print(f"{tpl:<9} {size:<6} {mode:<8} {count_pages(pdf):>5} {ms:>10.1f}")
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
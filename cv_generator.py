@@ -13,12 +13,30 @@ from reportlab.lib import colors
 from reportlab.lib.units import cm
 from reportlab.platypus import (
     BaseDocTemplate, SimpleDocTemplate, PageTemplate, Frame, Paragraph, Spacer,
-    Table, TableStyle, Image, FrameBreak, KeepInFrame
+    Table, TableStyle, Image, FrameBreak, KeepInFrame, Flowable, NextPageTemplate
 )
+from PIL import Image as PILImage, ImageOps
 from io import BytesIO
 from datetime import datetime, timezone
+from collections import OrderedDict
+from contextlib import contextmanager
+from xml.sax.saxutils import escape as xml_escape
+from urllib.parse import quote
 import requests
+import hashlib
+import tempfile
+import threading
+import time
+import resource
+import tracemalloc
+import unicodedata
+import signal
+import fcntl
+import zipfile
+import html
+import json
 import os
+import re
 
 # ===== Opcional: QR
 try:
@@ -29,6 +47,9 @@ except Exception:
 # ===== Stripe
 import stripe
 stripe.api_key = os.environ.get("STRIPE_SECRET_KEY", "")
+if os.environ.get("STRIPE_API_BASE"):
+    # Solo para pruebas: apunta el SDK a un Stripe falso (ver loadtest.py)
+    stripe.api_base = os.environ["STRIPE_API_BASE"]
 PRICE_MONTHLY = os.environ.get("STRIPE_PRICE_PRO_MONTHLY", "")
 PRICE_YEARLY  = os.environ.get("STRIPE_PRICE_PRO_YEARLY", "")
 WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET", "")
@@ -39,7 +60,34 @@ from psycopg.rows import dict_row
 
 DB_URL = os.environ.get("DATABASE_URL", "")
 
+# ===== Layout PDF
+# 'batched': un flowable por experiencia con medidas cacheadas (rápido en CVs largos)
+# 'flow':    un Paragraph por viñeta (comportamiento original)
+LAYOUT_MODE = os.environ.get("CV_LAYOUT_MODE", "batched").strip().lower()
+
+# ===== Fotos: derivado JPEG normalizado, cacheado en disco por hash del contenido
+PHOTO_CACHE_DIR = os.environ.get("PHOTO_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "cv_photo_cache")
+PHOTO_MAX_BYTES = int(os.environ.get("PHOTO_MAX_BYTES", 8 * 1024 * 1024))
+PHOTO_MAX_PIXELS = int(os.environ.get("PHOTO_MAX_PIXELS", 12_000_000))  # píxeles decodificados (tras draft)
+PHOTO_SIDE_PX = 600  # cuadrado; cubre la foto más grande (4.2 cm) a ~360 dpi
+PHOTO_CACHE_MAX_FILES = int(os.environ.get("PHOTO_CACHE_MAX_FILES", 2000))  # ~50-100 KB por derivado
+
+# ===== Caché de renders (todos los formatos), por hash del contenido
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", 64))
+
+# ===== Memoria: presupuesto por render y reciclado de workers (0 = desactivado)
+RENDER_MEM_BUDGET_MB = float(os.environ.get("RENDER_MEM_BUDGET_MB", 0))
+RENDER_TRACEMALLOC = os.environ.get("RENDER_TRACEMALLOC", "") == "1"  # más preciso, pero más lento
+WORKER_RSS_WATERMARK_MB = float(os.environ.get("WORKER_RSS_WATERMARK_MB", 0))
+WORKER_RECYCLE_MIN_RENDERS = int(os.environ.get("WORKER_RECYCLE_MIN_RENDERS", 50))  # evita reciclar en bucle
+WORKER_RECYCLE_SLOT_TIMEOUT = int(os.environ.get("WORKER_RECYCLE_SLOT_TIMEOUT", 120))  # s sin reemplazo: hueco libre
+WORKER_STATE_DIR = os.environ.get("WORKER_STATE_DIR") or os.path.join(tempfile.gettempdir(), "cv_workers")
+if RENDER_TRACEMALLOC:
+    tracemalloc.start()
+
 app = Flask(__name__)
+# Flask responde 413 antes de parsear cuerpos mayores (form o JSON)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_CONTENT_LENGTH", 512 * 1024))
 
 # ====================== DB helpers ======================
 
@@ -115,13 +163,98 @@ def fetch_image_bytes(url: str) -> bytes | None:
     if not url:
         return None
     try:
-        r = requests.get(url, timeout=10)
-        if r.ok and r.content:
-            return r.content
+        with requests.get(url, timeout=10, stream=True) as r:
+            if not r.ok or int(r.headers.get('Content-Length') or 0) > PHOTO_MAX_BYTES:
+                return None
+            buf = BytesIO()
+            for chunk in r.iter_content(64 * 1024):
+                buf.write(chunk)
+                if buf.tell() > PHOTO_MAX_BYTES:
+                    return None
+            return buf.getvalue() or None
     except Exception:
         pass
     return None
 
+def prepare_photo(raw: bytes | None) -> str | None:
+    """Normaliza la foto una sola vez: EXIF, recorte cuadrado, resize y JPEG.
+
+    Devuelve la ruta del derivado en PHOTO_CACHE_DIR (nombre = sha256 del
+    original). Con una ruta .jpg, ReportLab solo lee la cabecera y embebe los
+    bytes tal cual (DCTDecode); con un BytesIO decodificaría la imagen con PIL.
+    """
+    if not raw or len(raw) > PHOTO_MAX_BYTES:
+        return None
+    path = os.path.join(PHOTO_CACHE_DIR, hashlib.sha256(raw).hexdigest() + '.jpg')
+    try:
+        os.utime(path)  # acierto: refresca el mtime para la poda LRU
+        return path
+    except OSError:
+        pass
+
+    try:
+        with PILImage.open(BytesIO(raw)) as im:
+            # open() solo lee la cabecera. draft() (solo JPEG) elige una escala de
+            # decodificación y ajusta im.size: el límite va sobre lo que se decodifica
+            im.draft('RGB', (PHOTO_SIDE_PX, PHOTO_SIDE_PX))
+            if im.width * im.height > PHOTO_MAX_PIXELS:
+                return None
+            side = min(PHOTO_SIDE_PX, im.width, im.height)
+            # Reducir antes de girar, componer y convertir: las copias siguientes ya son pequeñas
+            scale = side / min(im.width, im.height)
+            im.thumbnail((max(side, round(im.width * scale)), max(side, round(im.height * scale))), PILImage.LANCZOS)
+            im = ImageOps.exif_transpose(im)
+            if im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info):
+                im = im.convert('RGBA')
+                bg = PILImage.new('RGB', im.size, 'white'); bg.paste(im, mask=im.getchannel('A')); im = bg
+            else:
+                im = im.convert('RGB')
+            side = min(side, im.width, im.height)
+            im = ImageOps.fit(im, (side, side), method=PILImage.LANCZOS)
+            out = BytesIO(); im.save(out, format='JPEG', quality=85, optimize=True)
+            jpeg = out.getvalue()
+    except Exception:
+        return None
+
+    try:
+        os.makedirs(PHOTO_CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(jpeg)
+        os.replace(tmp, path)
+    except OSError:
+        return None  # sin caché en disco no hay ruta que dar a ReportLab: CV sin foto
+    prune_photo_cache()
+    return path
+
+def prune_photo_cache():
+    """Mantiene PHOTO_CACHE_DIR por debajo de PHOTO_CACHE_MAX_FILES (borra los de mtime más antiguo)."""
+    try:
+        names = [n for n in os.listdir(PHOTO_CACHE_DIR) if n.endswith('.jpg')]
+    except OSError:
+        return
+    if len(names) <= PHOTO_CACHE_MAX_FILES:
+        return
+    entries = []
+    for n in names:
+        path = os.path.join(PHOTO_CACHE_DIR, n)
+        try: entries.append((os.stat(path).st_mtime, path))
+        except OSError: pass
+    entries.sort()
+    # Poda hasta el 90% para no recorrer el directorio en cada foto nueva
+    for _, path in entries[:len(entries) - int(PHOTO_CACHE_MAX_FILES * 0.9)]:
+        try: os.remove(path)
+        except OSError: pass
+
+def load_photo(url: str) -> str | None:
+    return prepare_photo(fetch_image_bytes(url))
+
+def photo_for(data: dict) -> str | None:
+    # render_cached resuelve la foto antes de calcular la clave y la deja en 'photo_path'
+    if 'photo_path' in data:
+        return data['photo_path']
+    return load_photo((data.get('photo_url') or '').strip())
+
 def make_qr_flowable(text: str):
     if not text or qrcode is None:
         return None
@@ -132,17 +265,240 @@ def make_qr_flowable(text: str):
     except Exception:
         return None
 
+def esc(text) -> str:
+    # El texto del usuario va a Paragraph, que interpreta su marcado (<b>, <font>...)
+    return xml_escape(text or '')
+
 def lines_to_bullets(text: str):
     text = (text or '').replace(';', '\n')
     return [ln.strip() for ln in text.split('\n') if ln.strip()]
 
-# ====================== Collectors (form) ======================
+class ExperienceBlock(Flowable):
+    """Cabecera + viñetas de una experiencia como un único flowable.
+
+    Mide cada parte una sola vez por ancho disponible y, si no cabe, corta
+    entre viñetas (nunca deja la cabecera huérfana). Así ReportLab no repite
+    wrap/split de cada Paragraph en CVs con decenas de puestos.
+    """
+    def __init__(self, parts, measured=None):
+        Flowable.__init__(self)
+        self.parts = list(parts)
+        # (availWidth, [(w, h, spaceBefore, spaceAfter) | None, ...]); None = por medir.
+        # Los bloques hijos de un split heredan las medidas del padre.
+        self._measured = measured
+
+    def _measure(self, aw):
+        if self._measured is None or self._measured[0] != aw:
+            self._measured = (aw, [None] * len(self.parts))
+        sizes = self._measured[1]
+        for i, p in enumerate(self.parts):
+            if sizes[i] is None:
+                w, h = p.wrap(aw, 0x7fffffff)
+                sizes[i] = (w, h, p.getSpaceBefore(), p.getSpaceAfter())
+        return sizes
+
+    def _child(self, parts, sizes):
+        return ExperienceBlock(parts, (self._measured[0], list(sizes)))
+
+    def wrap(self, availWidth, availHeight):
+        sizes = self._measure(availWidth)
+        self.width = availWidth
+        self.height = sum(h + sb + sa for (_, h, sb, sa) in sizes)
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        sizes = self._measure(availWidth)
+        used, n = 0, 0
+        for (_, h, sb, sa) in sizes:
+            if used + sb + h > availHeight:
+                break
+            used += sb + h + sa; n += 1
+        if n >= len(self.parts):
+            return [self]
+        if n == 1 and len(self.parts) > 1:
+            # Cabecera sola al pie: partir su primera viñeta o mover el bloque entero
+            pieces = self.parts[1].split(availWidth, availHeight - used)
+            if len(pieces) < 2:
+                sizes[1] = None  # un split fallido descarta el wrap del Paragraph
+                return []
+            return [self._child(self.parts[:1] + pieces[:1], sizes[:1] + [None]),
+                    self._child(pieces[1:] + self.parts[2:], [None] * (len(pieces) - 1) + sizes[2:])]
+        if n == 0:
+            if not getattr(self, '_postponed', False):
+                return []  # ni la cabecera cabe: el bloque entero al siguiente frame
+            # Ya en un frame nuevo y la cabecera sigue sin caber: partirla
+            pieces = self.parts[0].split(availWidth, availHeight)
+            if len(pieces) < 2:
+                sizes[0] = None
+                return []
+            return [self._child(pieces[:1], [None]),
+                    self._child(pieces[1:] + self.parts[1:], [None] * (len(pieces) - 1) + sizes[1:])]
+        return [self._child(self.parts[:n], sizes[:n]), self._child(self.parts[n:], sizes[n:])]
+
+    def draw(self, *args):
+        aw = self.width
+        sizes = self._measure(aw)
+        y = self.height
+        for p, (_, h, sb, sa) in zip(self.parts, sizes):
+            y -= sb + h
+            p.drawOn(self.canv, 0, y)
+            y -= sa
+
+def append_experience(story, header: str, desc: str, styles, bullet='•'):
+    parts = [Paragraph(header, styles['Body'])]
+    parts += [Paragraph(esc(b), styles['ListItem'], bulletText=bullet) for b in lines_to_bullets(desc)]
+    if LAYOUT_MODE == 'batched':
+        story.append(ExperienceBlock(parts))
+    else:
+        story.extend(parts)
+
+# ====================== Modelo CV (validación) ======================
+# Form y JSON se validan con el mismo esquema y producen el mismo `data`
+# (campos simples + listas exp_*/edu_*/skill) que consumen los renderers.
+
+TEMPLATES = ('classic', 'twocol', 'minimal', 'modern')
+SHORT, LONG = 200, 3000
+# Las viñetas (desc partido por ';' o saltos de línea) marcan el coste del render
+MAX_BULLETS_PER_EXP, MAX_BULLETS = 30, 200
+
+CV_SCHEMA = {
+    'template': ('str', 20), 'photo_url': ('str', 2048),
+    'full_name': ('str', SHORT), 'role': ('str', SHORT), 'city': ('str', SHORT),
+    'email': ('str', SHORT), 'phone': ('str', 50), 'website': ('str', 500),
+    'summary': ('text', LONG),
+    'skills': ('list', 60, ('str', 80)),
+    'experiences': ('list', 40, ('obj', {
+        'title': ('str', SHORT), 'company': ('str', SHORT), 'dates': ('str', 100), 'desc': ('text', LONG),
+    })),
+    'education': ('list', 20, ('obj', {
+        'title': ('str', SHORT), 'school': ('str', SHORT), 'dates': ('str', 100),
+    })),
+}
+
+class ValidationError(ValueError):
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+CONTROL_CHARS = re.compile(r'[\x00-\x1f\x7f]')
+XML_INVALID_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+
+def compile_schema(spec):
+    """Convierte el esquema declarativo en un validador (una vez, al importar).
+
+    El validador devuelve el valor normalizado y acumula los errores en
+    `errors`; las listas se cortan por longitud antes de mirar sus elementos.
+    """
+    kind = spec[0]
+    if kind in ('str', 'text'):
+        # 'str': una línea (va a cabeceras HTTP); 'text': admite \t \n \r.
+        # Ambos rechazan los caracteres de control no válidos en XML 1.0.
+        max_len = spec[1]
+        bad_chars = CONTROL_CHARS if kind == 'str' else XML_INVALID_CHARS
+        def check_str(value, path, errors):
+            if value is None:
+                return ''
+            if not isinstance(value, str):
+                errors.append(f"{path}: se esperaba texto"); return ''
+            if len(value) > max_len:
+                errors.append(f"{path}: máximo {max_len} caracteres"); return ''
+            if bad_chars.search(value):
+                errors.append(f"{path}: caracteres de control no permitidos"); return ''
+            return value
+        return check_str
+    if kind == 'list':
+        max_items, check_item = spec[1], compile_schema(spec[2])
+        def check_list(value, path, errors):
+            if value is None:
+                return []
+            if not isinstance(value, list):
+                errors.append(f"{path}: se esperaba una lista"); return []
+            if len(value) > max_items:
+                errors.append(f"{path}: máximo {max_items} elementos"); return []
+            return [check_item(v, f"{path}[{i}]", errors) for i, v in enumerate(value)]
+        return check_list
+    if kind == 'obj':
+        fields = {k: compile_schema(v) for k, v in spec[1].items()}
+        def check_obj(value, path, errors):
+            if not isinstance(value, dict):
+                errors.append(f"{path or 'cuerpo'}: se esperaba un objeto"); return {}
+            unknown = set(value) - set(fields)
+            if unknown:
+                errors.append(f"{path or 'cuerpo'}: campos desconocidos {sorted(unknown)}")
+            prefix = f"{path}." if path else ''
+            return {k: check(value.get(k), prefix + k, errors) for k, check in fields.items()}
+        return check_obj
+    raise ValueError(f"tipo de esquema desconocido: {kind}")
+
+validate_cv_payload = compile_schema(('obj', CV_SCHEMA))
+
+def payload_from_form(form) -> dict:
+    """Reagrupa los campos paralelos del formulario en la forma del JSON."""
+    def rows(keys, names):
+        cols = [form.getlist(k) for k in keys]
+        return [{n: (c[i] if i < len(c) else '') for n, c in zip(names, cols)}
+                for i in range(max(map(len, cols)))]
+    payload = {k: form.get(k, '') for k, spec in CV_SCHEMA.items() if spec[0] in ('str', 'text')}
+    skills = form.getlist('skill')
+    payload['skills'] = skills if skills else form.get('skills', '').split(',')
+    payload['experiences'] = rows(('exp_title', 'exp_company', 'exp_dates', 'exp_desc'), ('title', 'company', 'dates', 'desc'))
+    payload['education'] = rows(('edu_title', 'edu_school', 'edu_dates'), ('title', 'school', 'dates'))
+    return payload
+
+def cv_model(payload) -> dict:
+    """Valida el payload (form o JSON) y lo aplana al `data` de los renderers."""
+    errors = []
+    p = validate_cv_payload(payload, '', errors)
+    if not errors:
+        total = 0
+        for i, e in enumerate(p['experiences']):
+            n = len(lines_to_bullets(e['desc']))
+            total += n
+            if n > MAX_BULLETS_PER_EXP:
+                errors.append(f"experiences[{i}].desc: máximo {MAX_BULLETS_PER_EXP} viñetas")
+        if total > MAX_BULLETS:
+            errors.append(f"experiences: máximo {MAX_BULLETS} viñetas en total")
+    if errors:
+        raise ValidationError(errors)
+    data = {k: v for k, v in p.items() if isinstance(v, str)}
+    tpl = data['template'].strip().lower()
+    data['template'] = tpl if tpl in TEMPLATES else 'classic'
+    data['skill'] = p['skills']
+    for key in ('title', 'company', 'dates', 'desc'):
+        data[f'exp_{key}'] = [e[key] for e in p['experiences']]
+    for key in ('title', 'school', 'dates'):
+        data[f'edu_{key}'] = [e[key] for e in p['education']]
+    return data
+
+# maxlength y máximos del formulario HTML, derivados del mismo esquema
+FORM_LIMITS = {k: spec[1] for k, spec in CV_SCHEMA.items() if spec[0] in ('str', 'text')}
+FORM_LIMITS.update({f'exp_{k}': v[1] for k, v in CV_SCHEMA['experiences'][2][1].items()})
+FORM_LIMITS.update({f'edu_{k}': v[1] for k, v in CV_SCHEMA['education'][2][1].items()})
+FORM_LIMITS.update({
+    'skill': CV_SCHEMA['skills'][2][1], 'max_skills': CV_SCHEMA['skills'][1],
+    'max_exp': CV_SCHEMA['experiences'][1], 'max_edu': CV_SCHEMA['education'][1],
+    'max_bullets': MAX_BULLETS_PER_EXP,
+})
+
+def form_echo(form) -> dict:
+    """Datos enviados por el formulario, en la forma de empty_data(), para volver a pintarlo."""
+    data = empty_data()
+    for k, v in data.items():
+        if isinstance(v, str):
+            data[k] = form.get(k, '')
+        else:
+            cap = FORM_LIMITS['max_exp'] if k.startswith('exp_') else FORM_LIMITS['max_edu']
+            data[k] = form.getlist(k)[:cap]
+    data['skills'] = ','.join(form.getlist('skill')[:FORM_LIMITS['max_skills']]) or form.get('skills', '')
+    return data
+
+# ====================== Collectors ======================
 
 def collect_experiences(data: dict):
-    titles  = request.form.getlist('exp_title')  or data.get('exp_title',  [])
-    comps   = request.form.getlist('exp_company') or data.get('exp_company', [])
-    dates   = request.form.getlist('exp_dates')   or data.get('exp_dates',   [])
-    descs   = request.form.getlist('exp_desc')    or data.get('exp_desc',    [])
+    titles  = data.get('exp_title',   [])
+    comps   = data.get('exp_company', [])
+    dates   = data.get('exp_dates',   [])
+    descs   = data.get('exp_desc',    [])
     L = max(len(titles), len(comps), len(dates), len(descs)) if any([titles, comps, dates, descs]) else 0
     out = []
     for i in range(L):
@@ -154,9 +510,9 @@ def collect_experiences(data: dict):
     return out
 
 def collect_education(data: dict):
-    titles  = request.form.getlist('edu_title')  or data.get('edu_title',  [])
-    schools = request.form.getlist('edu_school') or data.get('edu_school', [])
-    dates   = request.form.getlist('edu_dates')  or data.get('edu_dates',  [])
+    titles  = data.get('edu_title',  [])
+    schools = data.get('edu_school', [])
+    dates   = data.get('edu_dates',  [])
     L = max(len(titles), len(schools), len(dates)) if any([titles, schools, dates]) else 0
     out = []
     for i in range(L):
@@ -167,12 +523,272 @@ def collect_education(data: dict):
     return out
 
 def collect_skills(data: dict):
-    skill_inputs = request.form.getlist('skill')
+    skill_inputs = data.get('skill') or []
     if skill_inputs:
         return [s.strip() for s in skill_inputs if s.strip()]
     raw = (data.get('skills') or '')
     return [s.strip() for s in raw.split(',') if s.strip()]
 
+# ====================== Memoria (render / workers) ======================
+# Cada worker contabiliza sus renders y vuelca sus cifras en WORKER_STATE_DIR,
+# de donde las lee /stats/memory. Las cifras de los workers que ya no existen
+# se acumulan en retired.json. El reciclado por RSS se serializa con un hueco
+# en recycle.lock (pid del worker que se recicla): lo libera su reemplazo al
+# atender su primera petición, así nunca falta más de un worker a la vez.
+
+MB = 1024 * 1024
+
+class RenderBudgetExceeded(RuntimeError):
+    pass
+
+RENDER_STATS = {
+    'renders': 0, 'cache_hits': 0, 'aborted': 0,
+    'last_peak_kb': 0, 'max_peak_kb': 0,            # tracemalloc (si RENDER_TRACEMALLOC=1)
+    'last_rss_peak_kb': 0, 'max_rss_peak_kb': 0,    # pico de RSS sobre el RSS al empezar
+    'rss_kb': 0, 'recycling': False, 'recycled_at': None,
+}
+RETIRED_KEYS = ('renders', 'cache_hits', 'aborted')  # se suman
+RETIRED_MAX_KEYS = ('max_peak_kb', 'max_rss_peak_kb')
+_render_state = threading.local()
+_stats_lock = threading.Lock()
+_recycling = False
+_stats_pid = None
+
+def current_rss() -> int:
+    # Solo Linux; en otros sistemas devuelve 0 (usa RENDER_TRACEMALLOC=1)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def reset_peak_rss() -> bool:
+    # Linux >= 4.0: VmHWM vuelve al RSS actual, así mide el pico de este render
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss() -> int:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # kB en Linux
+
+def write_worker_stats():
+    global _stats_pid
+    _stats_pid = os.getpid()
+    try:
+        os.makedirs(WORKER_STATE_DIR, exist_ok=True)
+        path = os.path.join(WORKER_STATE_DIR, f"worker-{os.getpid()}.json")
+        with _stats_lock:
+            body = json.dumps({'pid': os.getpid(), **RENDER_STATS})
+        with open(path + '.tmp', 'w') as f:
+            f.write(body)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass
+
+@contextmanager
+def render_guard():
+    """Mide el pico de memoria del render (foto incluida) y activa el presupuesto.
+
+    El pico de RSS sale de VmHWM reiniciado al empezar; si el kernel no deja
+    reiniciarlo, de ru_maxrss, que solo crece cuando el proceso bate su récord.
+    Un acierto de caché (`_render_state.cache_hit`) cuenta en `cache_hits`.
+    """
+    st = _render_state
+    st.cache_hit = False
+    rss0 = current_rss()
+    st.hwm0 = rss0 if reset_peak_rss() else peak_rss()
+    if RENDER_TRACEMALLOC:
+        tracemalloc.reset_peak()
+        st.traced0 = tracemalloc.get_traced_memory()[0]
+    aborted = False
+    try:
+        yield
+    except RenderBudgetExceeded:
+        aborted = True
+        raise
+    finally:
+        peak = traced_peak() if RENDER_TRACEMALLOC else 0
+        rss_peak = max(0, peak_rss() - st.hwm0)
+        rss = current_rss()
+        del st.hwm0
+        with _stats_lock:
+            RENDER_STATS['cache_hits' if st.cache_hit else 'renders'] += 1
+            RENDER_STATS['aborted'] += aborted
+            RENDER_STATS['last_peak_kb'] = peak // 1024
+            RENDER_STATS['max_peak_kb'] = max(RENDER_STATS['max_peak_kb'], peak // 1024)
+            RENDER_STATS['last_rss_peak_kb'] = rss_peak // 1024
+            RENDER_STATS['max_rss_peak_kb'] = max(RENDER_STATS['max_rss_peak_kb'], rss_peak // 1024)
+            RENDER_STATS['rss_kb'] = rss // 1024
+        write_worker_stats()
+
+def traced_peak() -> int:
+    return tracemalloc.get_traced_memory()[1] - _render_state.traced0
+
+def check_render_budget():
+    # Compara el mismo pico que publica /stats/memory (tracemalloc o RSS)
+    st = _render_state
+    if not RENDER_MEM_BUDGET_MB or not hasattr(st, 'hwm0'):
+        return
+    used = traced_peak() if RENDER_TRACEMALLOC else peak_rss() - st.hwm0
+    if used > RENDER_MEM_BUDGET_MB * MB:
+        raise RenderBudgetExceeded(f"render supera {RENDER_MEM_BUDGET_MB:g} MB")
+
+def build_doc(doc, story):
+    # ReportLab llama a afterFlowable tras colocar cada flowable: punto de corte barato
+    doc.afterFlowable = lambda flowable: check_render_budget()
+    doc.build(story)
+
+@contextmanager
+def recycle_slot():
+    """recycle.lock bajo flock; su contenido es el hueco: {'pid', 'at'} o vacío."""
+    os.makedirs(WORKER_STATE_DIR, exist_ok=True)
+    fd = os.open(os.path.join(WORKER_STATE_DIR, 'recycle.lock'), os.O_CREAT | os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield fd
+    finally:
+        os.close(fd)
+
+def read_slot(fd) -> dict | None:
+    try:
+        holder = json.loads(os.pread(fd, 256, 0) or b'null')
+    except ValueError:
+        return None
+    return holder if isinstance(holder, dict) else None
+
+def write_slot(fd, holder: dict | None):
+    os.ftruncate(fd, 0)
+    if holder:
+        os.pwrite(fd, json.dumps(holder).encode(), 0)
+
+def maybe_recycle_worker():
+    """Reinicio elegante (SIGTERM a sí mismo) si el RSS supera la marca.
+
+    Gunicorn termina la petición en curso y el master arranca otro worker.
+    El hueco sigue ocupado hasta que ese reemplazo atiende su primera
+    petición (release_recycle_slot), o WORKER_RECYCLE_SLOT_TIMEOUT segundos.
+    """
+    global _recycling
+    if not WORKER_RSS_WATERMARK_MB or _recycling:
+        return
+    if RENDER_STATS['renders'] < WORKER_RECYCLE_MIN_RENDERS:
+        return
+    if current_rss() < WORKER_RSS_WATERMARK_MB * MB:
+        return
+    try:
+        with recycle_slot() as fd:
+            holder = read_slot(fd)
+            if holder and time.time() - holder.get('at', 0) < WORKER_RECYCLE_SLOT_TIMEOUT:
+                return  # otro worker se recicla o su reemplazo aún no atiende; reintentamos luego
+            write_slot(fd, {'pid': os.getpid(), 'at': time.time()})
+    except OSError:
+        return
+    _recycling = True
+    with _stats_lock:
+        RENDER_STATS['recycling'] = True
+        RENDER_STATS['recycled_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    write_worker_stats()
+    os.kill(os.getpid(), signal.SIGTERM)
+
+def release_recycle_slot():
+    # Un worker nuevo ya atiende: si el que se recicló ha terminado, el hueco queda libre
+    try:
+        with recycle_slot() as fd:
+            holder = read_slot(fd)
+            if not holder:
+                return
+            try:
+                os.kill(holder['pid'], 0)
+                return  # aún termina su última petición
+            except ProcessLookupError:
+                write_slot(fd, None)
+    except (OSError, KeyError, TypeError):
+        pass
+
+def read_retired_stats() -> dict:
+    retired = {'workers': 0, 'recycled': 0, 'last_recycle': None,
+               **dict.fromkeys(RETIRED_KEYS + RETIRED_MAX_KEYS, 0)}
+    try:
+        with open(os.path.join(WORKER_STATE_DIR, 'retired.json')) as f:
+            retired.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    return retired
+
+def retire_worker_stats(path: str):
+    """Acumula las cifras de un worker muerto en retired.json y borra su fichero.
+
+    Bajo flock: varias lecturas concurrentes de /stats/memory no lo cuentan dos veces.
+    """
+    try:
+        fd = os.open(os.path.join(WORKER_STATE_DIR, 'retired.lock'), os.O_CREAT | os.O_RDWR)
+    except OSError:
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            with open(path) as f:
+                w = json.load(f)
+        except (OSError, ValueError):
+            return  # ya lo retiró otra lectura
+        retired = read_retired_stats()
+        retired['workers'] += 1
+        for k in RETIRED_KEYS:
+            retired[k] += w.get(k, 0)
+        for k in RETIRED_MAX_KEYS:
+            retired[k] = max(retired[k], w.get(k, 0))
+        if w.get('recycling'):
+            retired['recycled'] += 1
+            retired['last_recycle'] = {'pid': w.get('pid'), 'at': w.get('recycled_at'),
+                                       'rss_kb': w.get('rss_kb'), 'renders': w.get('renders')}
+        out = os.path.join(WORKER_STATE_DIR, 'retired.json')
+        with open(out + '.tmp', 'w') as f:
+            json.dump(retired, f)
+        os.replace(out + '.tmp', out)
+        os.remove(path)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def read_worker_stats() -> list[dict]:
+    workers = []
+    try:
+        names = os.listdir(WORKER_STATE_DIR)
+    except OSError:
+        return workers
+    for name in names:
+        if not (name.startswith('worker-') and name.endswith('.json')):
+            continue
+        path = os.path.join(WORKER_STATE_DIR, name)
+        try:
+            with open(path) as f:
+                w = json.load(f)
+            os.kill(w['pid'], 0)
+        except ProcessLookupError:
+            retire_worker_stats(path)  # worker reciclado o terminado
+            continue
+        except (OSError, ValueError, KeyError):
+            continue
+        workers.append(w)
+    return sorted(workers, key=lambda w: w['pid'])
+
+# Una marca por debajo del RSS en reposo reciclaría el worker en cuanto pudiera
+if WORKER_RSS_WATERMARK_MB and current_rss() >= WORKER_RSS_WATERMARK_MB * MB:
+    app.logger.warning("WORKER_RSS_WATERMARK_MB=%g está por debajo del RSS al arrancar (%d MB): "
+                       "el worker se reciclará cada %d renders",
+                       WORKER_RSS_WATERMARK_MB, current_rss() // MB, WORKER_RECYCLE_MIN_RENDERS)
+
 # ====================== Renderers PDF (4 plantillas) ======================
 
 def build_pdf_classic(data: dict, accent="#0b7285") -> bytes:
@@ -181,16 +797,16 @@ def build_pdf_classic(data: dict, accent="#0b7285") -> bytes:
     styles = build_styles(accent=accent)
     story = []
 
-    story.append(Paragraph(data.get('full_name') or 'Nombre Apellido', styles['Name']))
-    if data.get('role'): story.append(Paragraph(data['role'], styles['HeaderSmall']))
+    story.append(Paragraph(esc(data.get('full_name') or 'Nombre Apellido'), styles['Name']))
+    if data.get('role'): story.append(Paragraph(esc(data['role']), styles['HeaderSmall']))
     contact_bits = [data.get(k, '').strip() for k in ('email','phone','city','website') if data.get(k, '').strip()]
-    if contact_bits: story.append(Paragraph(" • ".join(contact_bits), styles['HeaderSmall']))
+    if contact_bits: story.append(Paragraph(esc(" • ".join(contact_bits)), styles['HeaderSmall']))
     story.append(Spacer(1, 10))
 
     side_items = []
-    wb = fetch_image_bytes((data.get('photo_url') or '').strip())
-    if wb:
-        try: side_items.append(Image(BytesIO(wb), width=3*cm, height=3*cm))
+    photo = photo_for(data)
+    if photo:
+        try: side_items.append(Image(photo, width=3*cm, height=3*cm))
         except Exception: pass
     qr = make_qr_flowable((data.get('website') or '').strip())
     if qr: side_items.append(qr)
@@ -201,7 +817,7 @@ def build_pdf_classic(data: dict, accent="#0b7285") -> bytes:
 
     if data.get('summary'):
         story.append(Paragraph('Resumen', styles['Section']))
-        story.append(Paragraph(data['summary'], styles['Body']))
+        story.append(Paragraph(esc(data['summary']), styles['Body']))
         story.append(Spacer(1, 6))
 
     skills = collect_skills(data)
@@ -226,23 +842,21 @@ def build_pdf_classic(data: dict, accent="#0b7285") -> bytes:
     if experiences:
         story.append(Paragraph('Experiencia', styles['Section']))
         for (title, company, dates, desc) in experiences:
-            story.append(Paragraph(f"<b>{title or 'Puesto'}</b> — {company or ''} <font color='#666666'>({dates or ''})</font>", styles['Body']))
-            for b in lines_to_bullets(desc):
-                story.append(Paragraph(b, styles['ListItem'], bulletText='•'))
+            append_experience(story, f"<b>{esc(title or 'Puesto')}</b> — {esc(company)} <font color='#666666'>({esc(dates)})</font>", desc, styles)
             story.append(Spacer(1, 4))
 
     edu_entries = collect_education(data)
     if edu_entries:
         story.append(Paragraph('Formación', styles['Section']))
         for (t_, s_, d_) in edu_entries:
-            story.append(Paragraph(f"<b>{t_ or 'Título'}</b> — {s_ or ''} <font color='#666666'>({d_ or ''})</font>", styles['Body']))
+            story.append(Paragraph(f"<b>{esc(t_ or 'Título')}</b> — {esc(s_)} <font color='#666666'>({esc(d_)})</font>", styles['Body']))
         story.append(Spacer(1, 4))
 
     generated = datetime.now().strftime('%Y-%m-%d')
     story.append(Spacer(1, 8))
     story.append(Paragraph(f"<font size=8 color='#888888'>Generado con cv_generator.py · {generated}</font>", styles['Body']))
 
-    doc.build(story)
+    build_doc(doc, story)
     pdf = buffer.getvalue(); buffer.close(); return pdf
 
 def build_pdf_twocol(data: dict, accent="#0b7285") -> bytes:
@@ -255,26 +869,31 @@ def build_pdf_twocol(data: dict, accent="#0b7285") -> bytes:
     frame_main = Frame(margin+sidebar_w+gap, margin, main_w, height-2*margin, id='main')
 
     doc = BaseDocTemplate(buffer, pagesize=A4, leftMargin=margin, rightMargin=margin, topMargin=margin, bottomMargin=margin)
-    doc.addPageTemplates([PageTemplate(id='TwoCol', frames=[frame_sidebar, frame_main])])
+    templates = [PageTemplate(id='TwoCol', frames=[frame_sidebar, frame_main])]
+    if LAYOUT_MODE == 'batched':
+        # Páginas de continuación: el contenido principal sigue a ancho completo
+        frame_cont = Frame(margin, margin, width-2*margin, height-2*margin, id='cont')
+        templates.append(PageTemplate(id='TwoColCont', frames=[frame_cont]))
+    doc.addPageTemplates(templates)
 
     story = []
 
-    wb = fetch_image_bytes((data.get('photo_url') or '').strip())
-    if wb:
-        try: story.append(Image(BytesIO(wb), width=4.2*cm, height=4.2*cm)); story.append(Spacer(1, 6))
+    photo = photo_for(data)
+    if photo:
+        try: story.append(Image(photo, width=4.2*cm, height=4.2*cm)); story.append(Spacer(1, 6))
         except Exception: pass
 
     full_name = data.get('full_name', '').strip() or 'Nombre Apellido'
     role = (data.get('role') or '').strip()
-    story.append(Paragraph(full_name, styles['SidebarTitle']))
-    if role: story.append(Paragraph(role, styles['Sidebar']))
+    story.append(Paragraph(esc(full_name), styles['SidebarTitle']))
+    if role: story.append(Paragraph(esc(role), styles['Sidebar']))
     story.append(Spacer(1, 4))
 
     contact_rows = []
     for label, key in (("Email","email"),("Tel.","phone"),("Ciudad","city"),("Web","website")):
         val = (data.get(key) or '').strip()
         if val:
-            contact_rows.append([Paragraph(f"<b>{label}:</b>", styles['Sidebar']), Paragraph(val, styles['Sidebar'])])
+            contact_rows.append([Paragraph(f"<b>{label}:</b>", styles['Sidebar']), Paragraph(esc(val), styles['Sidebar'])])
     if contact_rows:
         t = Table(contact_rows, colWidths=[2.2*cm, None])
         t.setStyle(TableStyle([
@@ -286,38 +905,41 @@ def build_pdf_twocol(data: dict, accent="#0b7285") -> bytes:
     skills = collect_skills(data)
     if skills:
         story.append(Paragraph('Habilidades', styles['SidebarTitle']))
-        for s in skills: story.append(Paragraph(f"• {s}", styles['Sidebar']))
+        for s in skills: story.append(Paragraph(f"• {esc(s)}", styles['Sidebar']))
         story.append(Spacer(1, 6))
 
     qr = make_qr_flowable((data.get('website') or '').strip())
     if qr: story.append(Paragraph('Perfil', styles['SidebarTitle'])); story.append(qr); story.append(Spacer(1, 10))
 
+    if LAYOUT_MODE == 'batched':
+        # El sidebar se encoge para caber en su frame en vez de desbordar al principal
+        story = [NextPageTemplate('TwoColCont'), KeepInFrame(sidebar_w, height-2*margin, story, mode='shrink')]
+
     story.append(FrameBreak())
 
     if data.get('summary'):
         story.append(Paragraph('Resumen', styles['Section']))
-        story.append(Paragraph(data['summary'], styles['Body']))
+        story.append(Paragraph(esc(data['summary']), styles['Body']))
         story.append(Spacer(1, 6))
 
     experiences = collect_experiences(data)
     if experiences:
         story.append(Paragraph('Experiencia', styles['Section']))
         for (title, company, dates, desc) in experiences:
-            story.append(Paragraph(f"<b>{title or 'Puesto'}</b> — {company or ''} <font color='#666666'>({dates or ''})</font>", styles['Body']))
-            for b in lines_to_bullets(desc): story.append(Paragraph(b, styles['ListItem'], bulletText='•'))
+            append_experience(story, f"<b>{esc(title or 'Puesto')}</b> — {esc(company)} <font color='#666666'>({esc(dates)})</font>", desc, styles)
             story.append(Spacer(1, 4))
 
     edu_entries = collect_education(data)
     if edu_entries:
         story.append(Paragraph('Formación', styles['Section']))
         for (t_, s_, d_) in edu_entries:
-            story.append(Paragraph(f"<b>{t_ or 'Título'}</b> — {s_ or ''} <font color='#666666'>({d_ or ''})</font>", styles['Body']))
+            story.append(Paragraph(f"<b>{esc(t_ or 'Título')}</b> — {esc(s_)} <font color='#666666'>({esc(d_)})</font>", styles['Body']))
         story.append(Spacer(1, 4))
 
     generated = datetime.now().strftime('%Y-%m-%d')
     story.append(Spacer(1, 8)); story.append(Paragraph(f"<font size=8 color='#888888'>Generado · {generated}</font>", styles['Body']))
 
-    doc.build(story)
+    build_doc(doc, story)
     pdf = buffer.getvalue(); buffer.close(); return pdf
 
 def build_pdf_minimal(data: dict) -> bytes:
@@ -325,8 +947,8 @@ def build_pdf_minimal(data: dict) -> bytes:
     doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=2*cm, rightMargin=2*cm, topMargin=2*cm, bottomMargin=2*cm)
     styles = build_styles(accent="#000000", mono=True)
     story = []
-    story.append(Paragraph((data.get('full_name') or 'Nombre Apellido').upper(), styles['Name']))
-    if data.get('role'): story.append(Paragraph(data['role'], styles['HeaderSmall']))
+    story.append(Paragraph(esc((data.get('full_name') or 'Nombre Apellido').upper()), styles['Name']))
+    if data.get('role'): story.append(Paragraph(esc(data['role']), styles['HeaderSmall']))
     story.append(Spacer(1, 8))
 
     def hr():
@@ -336,25 +958,24 @@ def build_pdf_minimal(data: dict) -> bytes:
 
     if data.get('summary'):
         story.append(Paragraph('RESUMEN', styles['Section']))
-        story.append(Paragraph(data['summary'], styles['Body']))
+        story.append(Paragraph(esc(data['summary']), styles['Body']))
         hr()
 
     skills = collect_skills(data)
     if skills:
         story.append(Paragraph('HABILIDADES', styles['Section']))
-        story.append(Paragraph(" · ".join(skills), styles['Body']))
+        story.append(Paragraph(esc(" · ".join(skills)), styles['Body']))
         hr()
 
     exps = collect_experiences(data)
     for title, company, dates, desc in exps:
-        story.append(Paragraph(f"<b>{title}</b> — {company} {dates}", styles['Body']))
-        for b in lines_to_bullets(desc): story.append(Paragraph(b, styles['ListItem'], bulletText='–'))
+        append_experience(story, f"<b>{esc(title)}</b> — {esc(company)} {esc(dates)}", desc, styles, bullet='–')
     if exps: hr()
 
     for t_, s_, d_ in collect_education(data):
-        story.append(Paragraph(f"<b>{t_}</b> — {s_} {d_}", styles['Body']))
+        story.append(Paragraph(f"<b>{esc(t_)}</b> — {esc(s_)} {esc(d_)}", styles['Body']))
 
-    doc.build(story)
+    build_doc(doc, story)
     pdf = buffer.getvalue(); buffer.close(); return pdf
 
 def build_pdf_modern(data: dict, accent="#2563eb") -> bytes:
@@ -363,8 +984,8 @@ def build_pdf_modern(data: dict, accent="#2563eb") -> bytes:
     styles = build_styles(accent=accent)
     story = []
 
-    head = Table([[Paragraph(data.get('full_name') or 'Nombre Apellido', styles['Name']),
-                   Paragraph(data.get('role',''), styles['HeaderSmall'])]], colWidths=[None, 6*cm])
+    head = Table([[Paragraph(esc(data.get('full_name') or 'Nombre Apellido'), styles['Name']),
+                   Paragraph(esc(data.get('role','')), styles['HeaderSmall'])]], colWidths=[None, 6*cm])
     head.setStyle(TableStyle([
         ('BACKGROUND',(0,0),(-1,-1), colors.HexColor(accent)),
         ('LEFTPADDING',(0,0),(-1,-1),10),('RIGHTPADDING',(0,0),(-1,-1),10),
@@ -374,33 +995,220 @@ def build_pdf_modern(data: dict, accent="#2563eb") -> bytes:
     story.append(head); story.append(Spacer(1,10))
 
     contact = [data.get(k,'').strip() for k in ('email','phone','city','website') if data.get(k,'').strip()]
-    if contact: story.append(Paragraph(" • ".join(contact), styles['HeaderSmall']))
+    if contact: story.append(Paragraph(esc(" • ".join(contact)), styles['HeaderSmall']))
     story.append(Spacer(1,6))
 
     if data.get('summary'):
         story.append(Paragraph('Resumen', styles['Section']))
-        story.append(Paragraph(data['summary'], styles['Body']))
+        story.append(Paragraph(esc(data['summary']), styles['Body']))
         story.append(Spacer(1,6))
 
     sk = collect_skills(data)
     if sk:
         story.append(Paragraph('Habilidades', styles['Section']))
-        story.append(Paragraph(" · ".join(sk), styles['Body']))
+        story.append(Paragraph(esc(" · ".join(sk)), styles['Body']))
         story.append(Spacer(1,6))
 
     for title, company, dates, desc in collect_experiences(data):
-        story.append(Paragraph(f"<b>{title}</b> — {company} <font color='#666666'>({dates})</font>", styles['Body']))
-        for b in lines_to_bullets(desc): story.append(Paragraph(b, styles['ListItem'], bulletText='•'))
+        append_experience(story, f"<b>{esc(title)}</b> — {esc(company)} <font color='#666666'>({esc(dates)})</font>", desc, styles)
         story.append(Spacer(1,4))
 
     ed = collect_education(data)
     if ed: story.append(Paragraph('Formación', styles['Section']))
     for t_, s_, d_ in ed:
-        story.append(Paragraph(f"<b>{t_}</b> — {s_} <font color='#666666'>({d_})</font>", styles['Body']))
+        story.append(Paragraph(f"<b>{esc(t_)}</b> — {esc(s_)} <font color='#666666'>({esc(d_)})</font>", styles['Body']))
 
-    doc.build(story)
+    build_doc(doc, story)
     pdf = buffer.getvalue(); buffer.close(); return pdf
 
+def build_pdf(data: dict) -> bytes:
+    tpl = data.get('template') or 'classic'
+    if tpl == 'twocol':    return build_pdf_twocol(data)
+    if tpl == 'minimal':   return build_pdf_minimal(data)
+    if tpl == 'modern':    return build_pdf_modern(data)
+    return build_pdf_classic(data)
+
+# ====================== Exportadores ligeros (HTML/MD/TXT/DOCX) ======================
+# Sin ReportLab: trabajan sobre el mismo `data` y los mismos collectors.
+
+def cv_content(data: dict) -> dict:
+    return {
+        'name': (data.get('full_name') or '').strip() or 'Nombre Apellido',
+        'role': (data.get('role') or '').strip(),
+        'contact': [data.get(k, '').strip() for k in ('email','phone','city','website') if data.get(k, '').strip()],
+        'summary': (data.get('summary') or '').strip(),
+        'skills': collect_skills(data),
+        'experiences': [(t, c, d, lines_to_bullets(ds)) for (t, c, d, ds) in collect_experiences(data)],
+        'education': collect_education(data),
+    }
+
+def export_html(data: dict) -> bytes:
+    cv = cv_content(data); e = html.escape
+    out = [
+        '<!doctype html><html lang="es"><head><meta charset="utf-8">',
+        f'<title>{e(cv["name"])}</title>',
+        '<style>body{font-family:system-ui,Helvetica,Arial,sans-serif;max-width:780px;margin:24px auto;padding:0 16px;color:#222}'
+        'h2{color:#0b7285;margin-top:20px}.muted{color:#666}</style></head><body>',
+        f'<h1>{e(cv["name"])}</h1>',
+    ]
+    if cv['role']: out.append(f'<p class="muted">{e(cv["role"])}</p>')
+    if cv['contact']: out.append(f'<p class="muted">{" • ".join(map(e, cv["contact"]))}</p>')
+    if cv['summary']: out += ['<h2>Resumen</h2>', f'<p>{e(cv["summary"])}</p>']
+    if cv['skills']: out += ['<h2>Habilidades</h2>', '<ul>', *[f'<li>{e(s)}</li>' for s in cv['skills']], '</ul>']
+    if cv['experiences']:
+        out.append('<h2>Experiencia</h2>')
+        for t, c, d, bullets in cv['experiences']:
+            out.append(f'<h3>{e(t or "Puesto")} — {e(c)} <span class="muted">({e(d)})</span></h3>')
+            if bullets: out += ['<ul>', *[f'<li>{e(b)}</li>' for b in bullets], '</ul>']
+    if cv['education']:
+        out.append('<h2>Formación</h2>')
+        for t, s_, d in cv['education']:
+            out.append(f'<p><b>{e(t or "Título")}</b> — {e(s_)} <span class="muted">({e(d)})</span></p>')
+    out.append('</body></html>')
+    return "\n".join(out).encode('utf-8')
+
+MD_INLINE = re.compile(r'([\\`*_\[\]<>|~&])')          # énfasis, enlaces, código, HTML, tablas
+MD_BLOCK = re.compile(r'^[ \t]*(?:([#+=-])|(\d+)([.)]))', re.M)   # títulos y listas al inicio de línea
+
+def md_escape(text: str) -> str:
+    # El texto del usuario es literal: ni títulos/listas ni HTML en bruto
+    text = MD_INLINE.sub(r'\\\1', text)
+    return MD_BLOCK.sub(lambda m: f"\\{m[1]}" if m[1] else f"{m[2]}\\{m[3]}", text)
+
+def export_markdown(data: dict) -> bytes:
+    cv = cv_content(data); e = md_escape
+    out = [f"# {e(cv['name'])}"]
+    if cv['role']: out.append(f"_{e(cv['role'])}_")
+    if cv['contact']: out.append(" • ".join(map(e, cv['contact'])))
+    if cv['summary']: out += ['', '## Resumen', '', e(cv['summary'])]
+    if cv['skills']: out += ['', '## Habilidades', '', *[f"- {e(s)}" for s in cv['skills']]]
+    if cv['experiences']:
+        out += ['', '## Experiencia']
+        for t, c, d, bullets in cv['experiences']:
+            out += ['', f"### {e(t or 'Puesto')} — {e(c)} ({e(d)})", *[f"- {e(b)}" for b in bullets]]
+    if cv['education']:
+        out += ['', '## Formación', '']
+        out += [f"- **{e(t or 'Título')}** — {e(s_)} ({e(d)})" for t, s_, d in cv['education']]
+    return ("\n".join(out) + "\n").encode('utf-8')
+
+def export_text(data: dict) -> bytes:
+    """Texto plano para ATS: sin tablas ni columnas, una línea por dato."""
+    cv = cv_content(data)
+    out = [cv['name'].upper()]
+    if cv['role']: out.append(cv['role'])
+    out += cv['contact']
+    if cv['summary']: out += ['', 'RESUMEN', cv['summary']]
+    if cv['skills']: out += ['', 'HABILIDADES', ", ".join(cv['skills'])]
+    if cv['experiences']:
+        out += ['', 'EXPERIENCIA']
+        for t, c, d, bullets in cv['experiences']:
+            out += [f"{t or 'Puesto'} - {c} ({d})", *[f"  - {b}" for b in bullets]]
+    if cv['education']:
+        out += ['', 'FORMACIÓN']
+        out += [f"{t or 'Título'} - {s_} ({d})" for t, s_, d in cv['education']]
+    return ("\n".join(out) + "\n").encode('utf-8')
+
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+def export_docx(data: dict) -> bytes:
+    """DOCX mínimo (WordprocessingML a mano con zipfile; sin python-docx)."""
+    cv = cv_content(data)
+    paras = []
+
+    def p(text, size=None, bold=False, color=None, indent=None):
+        rpr = ''.join([
+            '<w:b/>' if bold else '',
+            f'<w:color w:val="{color}"/>' if color else '',
+            f'<w:sz w:val="{size * 2}"/>' if size else '',
+        ])
+        ppr = f'<w:pPr><w:ind w:left="{indent}"/></w:pPr>' if indent else ''
+        paras.append(f'<w:p>{ppr}<w:r><w:rPr>{rpr}</w:rPr>'
+                     f'<w:t xml:space="preserve">{xml_escape(XML_INVALID_CHARS.sub("", text))}</w:t></w:r></w:p>')
+
+    p(cv['name'], size=20, bold=True)
+    if cv['role']: p(cv['role'], size=11, color='666666')
+    if cv['contact']: p(" • ".join(cv['contact']), size=11, color='666666')
+    if cv['summary']: p('Resumen', size=14, color='0B7285'); p(cv['summary'])
+    if cv['skills']: p('Habilidades', size=14, color='0B7285'); p(" · ".join(cv['skills']))
+    if cv['experiences']:
+        p('Experiencia', size=14, color='0B7285')
+        for t, c, d, bullets in cv['experiences']:
+            p(f"{t or 'Puesto'} — {c} ({d})", bold=True)
+            for b in bullets: p(f"• {b}", indent=360)
+    if cv['education']:
+        p('Formación', size=14, color='0B7285')
+        for t, s_, d in cv['education']: p(f"{t or 'Título'} — {s_} ({d})")
+
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body>{"".join(paras)}</w:body></w:document>'
+    )
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+        z.writestr('_rels/.rels', DOCX_RELS)
+        z.writestr('word/document.xml', document)
+    return buf.getvalue()
+
+# formato -> (exportador, Content-Type, extensión)
+EXPORTERS = {
+    'pdf':  (build_pdf, 'application/pdf', 'pdf'),
+    'html': (export_html, 'text/html; charset=utf-8', 'html'),
+    'md':   (export_markdown, 'text/markdown; charset=utf-8', 'md'),
+    'txt':  (export_text, 'text/plain; charset=utf-8', 'txt'),
+    'docx': (export_docx, 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'docx'),
+}
+
+_render_cache = OrderedDict()
+_render_cache_lock = threading.Lock()
+
+def render_cached(fmt: str, data: dict) -> bytes:
+    """Render de `data` en `fmt`, reutilizado si el contenido no ha cambiado.
+
+    La clave incluye la fecha porque el pie del PDF la muestra. Para el PDF la
+    foto se resuelve antes: su ruta en caché (sha256 del contenido) entra en la
+    clave, y si la URL no dio una foto válida el render no se cachea. Todo va
+    dentro de render_guard: la foto cuenta para el pico y el presupuesto.
+    """
+    cacheable = True
+    with render_guard():
+        if fmt == 'pdf' and 'photo_path' not in data:
+            url = (data.get('photo_url') or '').strip()
+            data = {**data, 'photo_path': load_photo(url) if url else None}
+            cacheable = not url or data['photo_path'] is not None
+            check_render_budget()  # decodificar la foto es la mayor asignación del render
+        raw = json.dumps([fmt, datetime.now().strftime('%Y-%m-%d'), data], sort_keys=True, ensure_ascii=False)
+        key = hashlib.sha256(raw.encode('utf-8')).hexdigest()
+        with _render_cache_lock:
+            if key in _render_cache:
+                _render_cache.move_to_end(key)
+                _render_state.cache_hit = True
+                return _render_cache[key]
+        out = EXPORTERS[fmt][0](data)
+    if not cacheable:
+        return out
+    with _render_cache_lock:
+        _render_cache[key] = out
+        while len(_render_cache) > RENDER_CACHE_SIZE:
+            _render_cache.popitem(last=False)
+    return out
+
 # ====================== HTML Form (UI) ======================
 
 FORM_HTML = """
@@ -428,6 +1236,7 @@ FORM_HTML = """
     .small{font-size:.85rem;color:#6b7280}
     .hr{height:1px;background:#edf2f7;margin:16px 0}
     .group{border:1px dashed #e5e7eb;border-radius:10px;padding:12px;margin:8px 0}
+    .errors{background:#fef2f2;color:#b91c1c;border-radius:8px;padding:10px 14px;margin:10px 0}
     .topbar{display:flex;gap:10px;align-items:center;justify-content:space-between;margin-bottom:10px}
   </style>
 </head>
@@ -442,6 +1251,9 @@ FORM_HTML = """
         </div>
       </div>
       <p class="muted">Rellena el formulario y obtén un PDF al instante.</p>
+      {% if errors %}
+      <div class="errors"><b>Revisa el formulario:</b><ul>{% for e in errors %}<li>{{ e }}</li>{% endfor %}</ul></div>
+      {% endif %}
       <form method="post" action="{{ url_for('generate') }}" id="cvform">
         <div class="row">
           <div>
@@ -455,30 +1267,30 @@ FORM_HTML = """
           </div>
           <div>
             <label>Foto (URL opcional)</label>
-            <input name="photo_url" value="{{ data.photo_url }}" placeholder="https://...jpg">
+            <input name="photo_url" maxlength="{{ limits.photo_url }}" value="{{ data.photo_url }}" placeholder="https://...jpg">
           </div>
         </div>
 
         <div class="section">
           <label>Nombre completo</label>
-          <input name="full_name" value="{{ data.full_name }}" required>
+          <input name="full_name" maxlength="{{ limits.full_name }}" value="{{ data.full_name }}" required>
         </div>
         <div class="row">
-          <div><label>Rol actual</label><input name="role" value="{{ data.role }}"></div>
-          <div><label>Ciudad</label><input name="city" value="{{ data.city }}"></div>
+          <div><label>Rol actual</label><input name="role" maxlength="{{ limits.role }}" value="{{ data.role }}"></div>
+          <div><label>Ciudad</label><input name="city" maxlength="{{ limits.city }}" value="{{ data.city }}"></div>
         </div>
         <div class="row">
-          <div><label>Email</label><input name="email" value="{{ data.email }}"></div>
-          <div><label>Teléfono</label><input name="phone" value="{{ data.phone }}"></div>
+          <div><label>Email</label><input name="email" maxlength="{{ limits.email }}" value="{{ data.email }}"></div>
+          <div><label>Teléfono</label><input name="phone" maxlength="{{ limits.phone }}" value="{{ data.phone }}"></div>
         </div>
         <div class="section">
           <label>Web/LinkedIn</label>
-          <input name="website" value="{{ data.website }}">
+          <input name="website" maxlength="{{ limits.website }}" value="{{ data.website }}">
         </div>
 
         <div class="section">
           <label>Resumen (2–4 líneas)</label>
-          <textarea name="summary">{{ data.summary }}</textarea>
+          <textarea name="summary" maxlength="{{ limits.summary }}">{{ data.summary }}</textarea>
         </div>
 
         <div class="section">
@@ -508,19 +1320,22 @@ FORM_HTML = """
 
 <script>
   function el(html){ const t=document.createElement('template'); t.innerHTML=html.trim(); return t.content.firstChild; }
+  function attr(v){ return String(v).replace(/&/g,'&amp;').replace(/"/g,'&quot;').replace(/</g,'&lt;'); }
+  function full(id, max){ return document.getElementById(id).children.length >= max; }
 
   function addExperience(pref={}){
+    if(full('expContainer', {{ limits.max_exp }})) return;
     const c=document.getElementById('expContainer');
     const g=el(`
       <div class="group">
         <div class="row-3">
-          <div><label>Puesto</label><input name="exp_title" value="${pref.title||''}"></div>
-          <div><label>Empresa</label><input name="exp_company" value="${pref.company||''}"></div>
-          <div><label>Fechas</label><input name="exp_dates" value="${pref.dates||''}"></div>
+          <div><label>Puesto</label><input name="exp_title" maxlength="{{ limits.exp_title }}" value="${attr(pref.title||'')}"></div>
+          <div><label>Empresa</label><input name="exp_company" maxlength="{{ limits.exp_company }}" value="${attr(pref.company||'')}"></div>
+          <div><label>Fechas</label><input name="exp_dates" maxlength="{{ limits.exp_dates }}" value="${attr(pref.dates||'')}"></div>
         </div>
         <div class="section">
-          <label>Logros/Tareas (una por línea o separadas por ';')</label>
-          <textarea name="exp_desc">${pref.desc||''}</textarea>
+          <label>Logros/Tareas (una por línea o separadas por ';'; máx. {{ limits.max_bullets }})</label>
+          <textarea name="exp_desc" maxlength="{{ limits.exp_desc }}">${attr(pref.desc||'')}</textarea>
         </div>
         <div class="btns"><button type="button" class="btn secondary" onclick="this.closest('.group').remove()">Eliminar</button></div>
       </div>`);
@@ -528,13 +1343,14 @@ FORM_HTML = """
   }
 
   function addEducation(pref={}){
+    if(full('eduContainer', {{ limits.max_edu }})) return;
     const c=document.getElementById('eduContainer');
     const g=el(`
       <div class="group">
         <div class="row-3">
-          <div><label>Título</label><input name="edu_title" value="${pref.title||''}"></div>
-          <div><label>Centro</label><input name="edu_school" value="${pref.school||''}"></div>
-          <div><label>Fechas</label><input name="edu_dates" value="${pref.dates||''}"></div>
+          <div><label>Título</label><input name="edu_title" maxlength="{{ limits.edu_title }}" value="${attr(pref.title||'')}"></div>
+          <div><label>Centro</label><input name="edu_school" maxlength="{{ limits.edu_school }}" value="${attr(pref.school||'')}"></div>
+          <div><label>Fechas</label><input name="edu_dates" maxlength="{{ limits.edu_dates }}" value="${attr(pref.dates||'')}"></div>
         </div>
         <div class="btns"><button type="button" class="btn secondary" onclick="this.closest('.group').remove()">Eliminar</button></div>
       </div>`);
@@ -542,8 +1358,9 @@ FORM_HTML = """
   }
 
   function addSkill(value=''){
+    if(full('skillsContainer', {{ limits.max_skills }})) return;
     const c=document.getElementById('skillsContainer');
-    const g=el(`<div class="group"><div class="row"><div><input name="skill" value="${value}" placeholder="p.ej. Python"></div><div><button type="button" class="btn secondary" onclick="this.closest('.group').remove()">Eliminar</button></div></div></div>`);
+    const g=el(`<div class="group"><div class="row"><div><input name="skill" maxlength="{{ limits.skill }}" value="${attr(value)}" placeholder="p.ej. Python"></div><div><button type="button" class="btn secondary" onclick="this.closest('.group').remove()">Eliminar</button></div></div></div>`);
     c.appendChild(g);
   }
 
@@ -577,23 +1394,104 @@ FORM_HTML = """
 def index():
     demo = request.args.get("demo")
     data = default_data() if demo else empty_data()
-    return render_template_string(FORM_HTML, data=data)
+    return render_template_string(FORM_HTML, data=data, limits=FORM_LIMITS, errors=[])
+
+def form_page(data: dict, errors: list[str], status: int):
+    # Errores de un envío del formulario: se vuelve a mostrar con lo enviado y la lista de errores
+    return render_template_string(FORM_HTML, data=data, limits=FORM_LIMITS, errors=errors), status
+
+def wants_form_page() -> bool:
+    return request.endpoint == 'generate' and not request.is_json
+
+def parse_formats(raw: str | None) -> list[str]:
+    formats = []
+    for f in (raw or 'pdf').lower().split(','):
+        f = f.strip()
+        if f and f not in formats: formats.append(f)
+    unknown = [f for f in formats if f not in EXPORTERS]
+    if unknown or not formats:
+        raise ValidationError([f"format: valores permitidos {', '.join(EXPORTERS)}"])
+    return formats
+
+def render_response(data: dict, formats: list[str]):
+    name = data.get('full_name') or ''
+    base = "CV_" + (re.sub(r'[^\w.-]+', '_', name).strip('_') or 'anonimo')
+    # Las cabeceras HTTP son latin-1: filename= lleva una versión ASCII y
+    # filename* (RFC 6266) el nombre real
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    ascii_base = "CV_" + (re.sub(r'[^\w.-]+', '_', ascii_name, flags=re.ASCII).strip('_') or 'anonimo')
+    if len(formats) == 1:
+        _, content_type, ext = EXPORTERS[formats[0]]
+        body = render_cached(formats[0], data)
+    else:
+        # Varios formatos: un único ZIP con un fichero por formato
+        buf = BytesIO()
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+            for f in formats:
+                z.writestr(f"{base}.{EXPORTERS[f][2]}", render_cached(f, data))
+        body, content_type, ext = buf.getvalue(), 'application/zip', 'zip'
+    resp = make_response(body)
+    resp.headers['Content-Type'] = content_type
+    resp.headers['Content-Disposition'] = (f'attachment; filename="{ascii_base}.{ext}"; '
+                                           f"filename*=UTF-8''{quote(f'{base}.{ext}', safe='')}")
+    return resp
 
 @app.post("/generate")
 def generate():
-    simple_fields = ['template','photo_url','full_name','role','city','email','phone','website','summary','skills']
-    data = {k: request.form.get(k, '') for k in simple_fields}
-
-    tpl = (data.get('template') or 'classic').strip().lower()
-    if tpl == 'twocol':       pdf = build_pdf_twocol(data)
-    elif tpl == 'minimal':    pdf = build_pdf_minimal(data)
-    elif tpl == 'modern':     pdf = build_pdf_modern(data)
-    else:                     pdf = build_pdf_classic(data)
-
-    filename = f"CV_{(data.get('full_name') or 'anonimo').replace(' ', '_')}.pdf"
-    resp = make_response(pdf)
-    resp.headers['Content-Type'] = 'application/pdf'
-    resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    payload = request.get_json(silent=True) if request.is_json else payload_from_form(request.form)
+    try:
+        formats = parse_formats(request.args.get('format'))
+        data = cv_model(payload)
+    except ValidationError as e:
+        if request.is_json:
+            return jsonify({"error": "CV no válido", "details": e.errors}), 400
+        return form_page(form_echo(request.form), e.errors, 400)
+    return render_response(data, formats)
+
+# API JSON: mismo modelo y validación que el formulario
+@app.post("/api/generate")
+def api_generate():
+    if not request.is_json:
+        return jsonify({"error": "Content-Type debe ser application/json"}), 415
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({"error": "JSON no válido"}), 400
+    try:
+        formats = parse_formats(request.args.get('format'))
+        data = cv_model(payload)
+    except ValidationError as e:
+        return jsonify({"error": "CV no válido", "details": e.errors}), 400
+    return render_response(data, formats)
+
+@app.errorhandler(413)
+def too_large(e):
+    error = f"Petición demasiado grande (máx. {app.config['MAX_CONTENT_LENGTH']} bytes)"
+    if wants_form_page():
+        return form_page(empty_data(), [error], 413)  # el cuerpo no se llegó a leer: formulario vacío
+    return jsonify({"error": error}), 413
+
+@app.errorhandler(RenderBudgetExceeded)
+def render_too_heavy(e):
+    error = f"CV demasiado pesado para renderizar ({e})"
+    if wants_form_page():
+        return form_page(form_echo(request.form), [error], 413)
+    return jsonify({"error": error}), 413
+
+@app.before_request
+def announce_worker():
+    # Primera petición del proceso: el worker aparece en /stats/memory aunque no haya
+    # renderizado y, si es el reemplazo de uno reciclado, libera el hueco de reciclado
+    if _stats_pid != os.getpid():
+        write_worker_stats()
+        if WORKER_RSS_WATERMARK_MB:
+            release_recycle_slot()
+
+@app.after_request
+def recycle_after_render(resp):
+    # Solo bajo gunicorn: el servidor de desarrollo no relanza el proceso
+    if request.endpoint in ('generate', 'api_generate') and \
+            request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+        resp.call_on_close(maybe_recycle_worker)
     return resp
 
 # ====================== Billing (Stripe) ======================
@@ -739,6 +1637,19 @@ def stripe_webhook():
 def health():
     return {"ok": True}
 
+# Memoria de render por worker (vivos y acumulado de los retirados) y límites
+@app.get("/stats/memory")
+def memory_stats():
+    workers = read_worker_stats()
+    return {
+        "budget_mb": RENDER_MEM_BUDGET_MB,
+        "rss_watermark_mb": WORKER_RSS_WATERMARK_MB,
+        "recycle_min_renders": WORKER_RECYCLE_MIN_RENDERS,
+        "tracemalloc": RENDER_TRACEMALLOC,
+        "workers": workers,
+        "retired": read_retired_stats(),
+    }
+
 # Ver plan por email (debug)
 @app.get("/me")
 def me():
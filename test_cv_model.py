@@ -0,0 +1,159 @@
+# test_cv_model.py
+# -------------------------------------------------------------
+# Validación de entrada de /generate y /api/generate: esquema compilado,
+# límites, mapeo formulario -> payload y modelo `data` de los renderers.
+# Uso: python -m pytest -q
+# -------------------------------------------------------------
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import cv_generator as cvg
+
+
+def model(**payload):
+    return cvg.cv_model(payload)
+
+def errors_of(**payload):
+    with pytest.raises(cvg.ValidationError) as exc:
+        cvg.cv_model(payload)
+    return exc.value.errors
+
+# ---------- esquema compilado ----------
+
+def test_compile_schema_str_limits_and_types():
+    check = cvg.compile_schema(('str', 5))
+    errors = []
+    assert check('abc', 'f', errors) == 'abc'
+    assert check(None, 'f', errors) == ''
+    assert errors == []
+    check('abcdef', 'f', errors); check(3, 'g', errors)
+    assert errors == ['f: máximo 5 caracteres', 'g: se esperaba texto']
+
+def test_compile_schema_list_rejects_before_checking_items():
+    check = cvg.compile_schema(('list', 2, ('str', 1)))
+    errors = []
+    assert check(['xx'] * 3, 'l', errors) == []
+    assert errors == ['l: máximo 2 elementos']  # sin un error por elemento
+
+def test_unknown_keys_rejected():
+    assert any('campos desconocidos' in e for e in errors_of(full_name='A', foo=1))
+    errs = errors_of(experiences=[{'title': 'x', 'salary': 1}])
+    assert errs == ["experiences[0]: campos desconocidos ['salary']"]
+
+def test_wrong_types():
+    errs = errors_of(skills='Python', experiences=[{'title': 5}], education={})
+    assert 'skills: se esperaba una lista' in errs
+    assert 'experiences[0].title: se esperaba texto' in errs
+    assert 'education: se esperaba una lista' in errs
+    with pytest.raises(cvg.ValidationError):
+        cvg.cv_model(['no', 'es', 'objeto'])
+
+# ---------- límites ----------
+
+def test_text_and_list_caps():
+    errs = errors_of(summary='x' * (cvg.LONG + 1), experiences=[{}] * 41, skills=['a'] * 61)
+    assert f'summary: máximo {cvg.LONG} caracteres' in errs
+    assert 'experiences: máximo 40 elementos' in errs
+    assert 'skills: máximo 60 elementos' in errs
+
+def test_bullets_per_experience_cap():
+    desc = ';'.join(['a'] * (cvg.MAX_BULLETS_PER_EXP + 1))
+    assert errors_of(experiences=[{'desc': desc}]) == [
+        f'experiences[0].desc: máximo {cvg.MAX_BULLETS_PER_EXP} viñetas']
+    # ';' vacíos no cuentan: mismo criterio que lines_to_bullets
+    model(experiences=[{'desc': ';' * 2000 + 'a'}])
+
+def test_total_bullets_cap():
+    desc = ';'.join(['a'] * cvg.MAX_BULLETS_PER_EXP)
+    n = cvg.MAX_BULLETS // cvg.MAX_BULLETS_PER_EXP + 1
+    assert errors_of(experiences=[{'desc': desc}] * n) == [
+        f'experiences: máximo {cvg.MAX_BULLETS} viñetas en total']
+
+def test_control_characters():
+    assert errors_of(full_name='Ana\nX-Header: 1') == ['full_name: caracteres de control no permitidos']
+    assert errors_of(summary='a\x0bb') == ['summary: caracteres de control no permitidos']
+    data = model(summary='línea 1\nlínea 2\ttab', experiences=[{'desc': 'a\r\nb'}])
+    assert data['summary'] == 'línea 1\nlínea 2\ttab'
+
+# ---------- modelo y formulario ----------
+
+def test_cv_model_flattens_to_renderer_data():
+    data = model(template='TWOCOL', full_name='Ana', skills=['Python'],
+                 experiences=[{'title': 'Dev', 'desc': 'a;b'}], education=[{'school': 'UCM'}])
+    assert data['template'] == 'twocol'
+    assert data['skill'] == ['Python']
+    assert data['exp_title'] == ['Dev'] and data['exp_company'] == [''] and data['exp_desc'] == ['a;b']
+    assert data['edu_school'] == ['UCM'] and data['edu_title'] == ['']
+    assert cvg.collect_experiences(data) == [('Dev', '', '', 'a;b')]
+    assert model(template='nope')['template'] == 'classic'
+
+def test_payload_from_form_pads_parallel_lists():
+    form = MultiDict([
+        ('full_name', 'Ana'), ('summary', 'Hola'),
+        ('exp_title', 'A'), ('exp_title', 'B'), ('exp_company', 'X'), ('exp_desc', 'd1'),
+        ('edu_title', 'Grado'), ('skill', 'Python'), ('skill', 'SQL'),
+    ])
+    p = cvg.payload_from_form(form)
+    assert p['full_name'] == 'Ana' and p['summary'] == 'Hola' and p['role'] == ''
+    assert p['experiences'] == [
+        {'title': 'A', 'company': 'X', 'dates': '', 'desc': 'd1'},
+        {'title': 'B', 'company': '', 'dates': '', 'desc': ''},
+    ]
+    assert p['education'] == [{'title': 'Grado', 'school': '', 'dates': ''}]
+    assert p['skills'] == ['Python', 'SQL']
+    assert cvg.payload_from_form(MultiDict([('skills', 'a, b')]))['skills'] == ['a', ' b']
+    cvg.cv_model(p)  # lo que produce el formulario siempre pasa el esquema
+
+# ---------- endpoints ----------
+
+@pytest.fixture
+def client():
+    return cvg.app.test_client()
+
+def test_form_over_cap_gets_html_form_back(client):
+    r = client.post('/generate', data={'full_name': 'Ana', 'exp_desc': ';'.join(['a'] * 31)})
+    assert r.status_code == 400
+    assert r.mimetype == 'text/html'
+    body = r.get_data(as_text=True)
+    assert 'máximo 30 viñetas' in body and 'maxlength=' in body
+
+def test_json_errors_stay_json(client):
+    r = client.post('/api/generate', json={'full_name': 'Ana\r\n'})
+    assert r.status_code == 400 and r.json['details'] == ['full_name: caracteres de control no permitidos']
+
+def test_user_markup_is_text_not_reportlab_markup(client):
+    r = client.post('/api/generate?format=pdf', json={
+        'full_name': 'Ana "<b>"', 'summary': '<b>sin cerrar & <font', 'skills': ['C<'],
+        'experiences': [{'title': '<i>', 'desc': 'a & b; <para>'}]})
+    assert r.status_code == 200 and r.mimetype == 'application/pdf'
+    assert 'filename="CV_Ana_b.pdf"' in r.headers['Content-Disposition']
+
+@pytest.mark.parametrize('name, ascii_name, quoted', [
+    ('Łukasz Nowak', 'CV_ukasz_Nowak', 'CV_%C5%81ukasz_Nowak'),
+    ('José Galán', 'CV_Jose_Galan', 'CV_Jos%C3%A9_Gal%C3%A1n'),
+    ('李小龍', 'CV_anonimo', 'CV_%E6%9D%8E%E5%B0%8F%E9%BE%8D'),
+])
+def test_download_filename_is_ascii_with_utf8_variant(client, name, ascii_name, quoted):
+    r = client.post('/api/generate?format=txt', json={'full_name': name})
+    disposition = r.headers['Content-Disposition']
+    disposition.encode('latin-1')  # lo que exige el servidor WSGI
+    assert disposition == f'attachment; filename="{ascii_name}.txt"; filename*=UTF-8\'\'{quoted}.txt'
+
+def test_form_too_large_gets_html_form(client, monkeypatch):
+    monkeypatch.setitem(cvg.app.config, 'MAX_CONTENT_LENGTH', 1000)
+    r = client.post('/generate', data={'summary': 'x' * 2000})
+    assert r.status_code == 413 and r.mimetype == 'text/html'
+    assert 'Petición demasiado grande' in r.get_data(as_text=True)
+    r = client.post('/api/generate', json={'summary': 'x' * 2000})
+    assert r.status_code == 413 and r.mimetype == 'application/json'
+
+def test_form_over_render_budget_gets_html_form(client, monkeypatch):
+    def too_heavy(data):
+        raise cvg.RenderBudgetExceeded('render supera 1 MB')
+    monkeypatch.setitem(cvg.EXPORTERS, 'pdf', (too_heavy,) + cvg.EXPORTERS['pdf'][1:])
+    r = client.post('/generate', data={'full_name': 'Ana Pesada'})
+    body = r.get_data(as_text=True)
+    assert r.status_code == 413 and r.mimetype == 'text/html'
+    assert 'CV demasiado pesado' in body and 'value="Ana Pesada"' in body
+    r = client.post('/api/generate', json={'full_name': 'Ana Pesada'})
+    assert r.status_code == 413 and r.json['error'].startswith('CV demasiado pesado')
@@ -0,0 +1,109 @@
+# test_exporters.py
+# -------------------------------------------------------------
+# Exportadores ligeros y caché de renders por contenido.
+# Uso: python -m pytest -q
+# -------------------------------------------------------------
+import io
+import zipfile
+from xml.dom import minidom
+
+import pytest
+from PIL import Image
+
+import cv_generator as cvg
+
+
+def test_docx_is_well_formed_with_control_chars():
+    docx = cvg.export_docx({'full_name': 'Ana & <Co>', 'summary': 'a\x0bb\x00c'})
+    xml = zipfile.ZipFile(io.BytesIO(docx)).read('word/document.xml')
+    texts = [''.join(n.data for n in t.childNodes) for t in minidom.parseString(xml).getElementsByTagName('w:t')]
+    assert 'Ana & <Co>' in texts and 'abc' in texts
+
+@pytest.fixture
+def fake_photos(monkeypatch, tmp_path):
+    """fetch_image_bytes controlado: color actual de la foto y fallos pendientes."""
+    state = {'color': 'red', 'fail': 0, 'renders': 0}
+    def fetch(url):
+        if state['fail']:
+            state['fail'] -= 1
+            return None
+        buf = io.BytesIO(); Image.new('RGB', (200, 200), state['color']).save(buf, 'JPEG')
+        return buf.getvalue()
+    build = cvg.EXPORTERS['pdf'][0]
+    def counting_build(data):
+        state['renders'] += 1
+        return build(data)
+    monkeypatch.setattr(cvg, 'fetch_image_bytes', fetch)
+    monkeypatch.setattr(cvg, 'PHOTO_CACHE_DIR', str(tmp_path))
+    monkeypatch.setitem(cvg.EXPORTERS, 'pdf', (counting_build,) + cvg.EXPORTERS['pdf'][1:])
+    monkeypatch.setattr(cvg, '_render_cache', cvg.OrderedDict())
+    return state
+
+def test_pdf_cache_keyed_on_photo_content(fake_photos):
+    data = cvg.cv_model({'full_name': 'Ana', 'photo_url': 'http://img/p.jpg'})
+    fake_photos['fail'] = 1
+    cvg.render_cached('pdf', data)          # foto caída: no se cachea
+    cvg.render_cached('pdf', data)
+    assert fake_photos['renders'] == 2
+    cvg.render_cached('pdf', data)          # misma foto: acierto
+    assert fake_photos['renders'] == 2
+    fake_photos['color'] = 'blue'           # misma URL, otra imagen
+    cvg.render_cached('pdf', data)
+    assert fake_photos['renders'] == 3
+
+# ---------- ?format= en los endpoints ----------
+
+CV = {'full_name': 'Ana Ruiz', 'role': 'Dev', 'summary': 'Resumen corto', 'skills': ['Python'],
+      'experiences': [{'title': 'Dev', 'company': 'ACME', 'dates': '2020', 'desc': 'uno; dos'}],
+      'education': [{'title': 'Grado', 'school': 'UCM', 'dates': '2016'}]}
+
+@pytest.fixture
+def client():
+    return cvg.app.test_client()
+
+@pytest.mark.parametrize('fmt, mimetype, marker', [
+    ('pdf', 'application/pdf', b'%PDF'),
+    ('html', 'text/html', b'<h1>Ana Ruiz</h1>'),
+    ('md', 'text/markdown', b'# Ana Ruiz\n'),
+    ('txt', 'text/plain', b'ANA RUIZ\n'),
+    ('docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', b'PK'),
+])
+def test_format_switch(client, fmt, mimetype, marker):
+    r = client.post(f'/api/generate?format={fmt}', json=CV)
+    assert r.status_code == 200 and r.mimetype == mimetype
+    assert f'filename="CV_Ana_Ruiz.{fmt}"' in r.headers['Content-Disposition']
+    assert r.data.startswith(marker) or marker in r.data
+
+def test_text_exports_content(client):
+    html_ = client.post('/api/generate?format=html', json=CV).get_data(as_text=True)
+    assert '<li>uno</li><li>dos</li>' in html_.replace('\n', '')
+    txt = client.post('/api/generate?format=txt', json=CV).get_data(as_text=True)
+    assert txt.splitlines()[:2] == ['ANA RUIZ', 'Dev']
+    assert 'EXPERIENCIA\nDev - ACME (2020)\n  - uno\n  - dos\n' in txt
+    md = client.post('/api/generate?format=md', json=CV).get_data(as_text=True)
+    assert '### Dev — ACME (2020)\n- uno\n- dos\n' in md
+    assert '- **Grado** — UCM (2016)' in md
+
+def test_unknown_format_is_400(client):
+    r = client.post('/api/generate?format=pdf,odt', json=CV)
+    assert r.status_code == 400 and r.json['details'] == ['format: valores permitidos pdf, html, md, txt, docx']
+    r = client.post('/generate?format=odt', data={'full_name': 'Ana'})
+    assert r.status_code == 400 and r.mimetype == 'text/html'
+
+def test_several_formats_bundle_zip(client):
+    r = client.post('/api/generate?format=txt,md,txt,html', json=CV)
+    assert r.status_code == 200 and r.mimetype == 'application/zip'
+    assert 'filename="CV_Ana_Ruiz.zip"' in r.headers['Content-Disposition']
+    z = zipfile.ZipFile(io.BytesIO(r.data))
+    assert z.namelist() == ['CV_Ana_Ruiz.txt', 'CV_Ana_Ruiz.md', 'CV_Ana_Ruiz.html']
+    assert z.read('CV_Ana_Ruiz.txt') == client.post('/api/generate?format=txt', json=CV).data
+
+def test_html_and_markdown_escape_user_text(client):
+    cv = {**CV, 'full_name': '<script>alert(1)</script>', 'summary': '# hi\n  - item\n1. uno\n---',
+          'skills': ['*negrita* [x](http://e.vil)']}
+    html_ = client.post('/api/generate?format=html', json=cv).get_data(as_text=True)
+    assert '<script>' not in html_
+    md = client.post('/api/generate?format=md', json=cv).get_data(as_text=True)
+    assert md.startswith('# \\<script\\>alert(1)\\</script\\>\n')
+    assert '\\# hi\n\\- item\n1\\. uno\n\\---' in md
+    assert '- \\*negrita\\* \\[x\\](http://e.vil)' in md
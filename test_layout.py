@@ -0,0 +1,69 @@
+# test_layout.py
+# -------------------------------------------------------------
+# Layout PDF 'batched' (ExperienceBlock) frente a 'flow'.
+# Uso: python -m pytest -q
+# -------------------------------------------------------------
+from io import BytesIO
+
+import pytest
+from reportlab.lib.units import cm
+from reportlab.platypus import Paragraph, SimpleDocTemplate
+
+import cv_generator as cvg
+from bench_layout import BUILDERS, SIZES, count_pages, make_data
+
+
+def render(monkeypatch, mode, build, data):
+    monkeypatch.setattr(cvg, 'LAYOUT_MODE', mode)
+    return count_pages(build(data))
+
+@pytest.mark.parametrize('size', ['3p', '10p'])
+@pytest.mark.parametrize('tpl', sorted(BUILDERS))
+def test_batched_page_count_matches_flow(monkeypatch, tpl, size):
+    data = make_data(*SIZES[size])
+    flow = render(monkeypatch, 'flow', BUILDERS[tpl], data)
+    batched = render(monkeypatch, 'batched', BUILDERS[tpl], data)
+    if tpl == 'twocol':
+        # batched usa páginas de continuación a ancho completo: nunca más páginas
+        assert batched <= flow
+    else:
+        assert batched == flow
+
+def block(desc, header='<b>Puesto</b> — Empresa (2020 – 2024)'):
+    styles = cvg.build_styles()
+    parts = [Paragraph(header, styles['Body'])]
+    parts += [Paragraph(cvg.esc(b), styles['ListItem'], bulletText='•') for b in cvg.lines_to_bullets(desc)]
+    return cvg.ExperienceBlock(parts)
+
+def test_header_never_alone_at_frame_bottom():
+    aw = 15 * cm
+    desc = '; '.join(['logro con texto suficiente para ocupar dos líneas del ancho disponible ' * 2] * 3)
+    _, total = block(desc).wrap(aw, 1e6)
+    for h in range(0, int(total)):
+        b = block(desc)
+        pieces = b.split(aw, h)
+        if not pieces:
+            continue  # el bloque entero pasa al siguiente frame
+        first = pieces[0]
+        assert first.parts[0] is b.parts[0]
+        assert len(first.parts) >= 2, f'cabecera sola con {h}pt disponibles'
+        assert first.wrap(aw, h)[1] <= h
+
+def test_header_splits_only_after_moving_to_new_frame():
+    aw = 6 * cm
+    b = block('a', header=' '.join(['cabecera muy larga'] * 20))
+    assert b.split(aw, 30) == []
+    b._postponed = 1  # ReportLab ya lo movió a un frame nuevo y sigue sin caber
+    first, rest = b.split(aw, 30)
+    assert first.wrap(aw, 30)[1] <= 30 and len(rest.parts) == 2
+
+@pytest.mark.parametrize('mode', ['flow', 'batched'])
+def test_bullet_taller_than_page_still_splits(monkeypatch, mode):
+    # Página diminuta: una viñeta de 3000 caracteres ocupa varias
+    monkeypatch.setattr(cvg, 'LAYOUT_MODE', mode)
+    story = []
+    cvg.append_experience(story, '<b>Puesto</b>', 'palabra ' * 375, cvg.build_styles())
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=(12*cm, 8*cm), leftMargin=cm, rightMargin=cm, topMargin=cm, bottomMargin=cm)
+    cvg.build_doc(doc, story)
+    assert count_pages(buf.getvalue()) > 2
@@ -0,0 +1,123 @@
+# test_memory_stats.py
+# -------------------------------------------------------------
+# Estadísticas de memoria por worker y reciclado por RSS.
+# Uso: python -m pytest -q
+# -------------------------------------------------------------
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import pytest
+
+import cv_generator as cvg
+
+
+@pytest.fixture
+def state_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(cvg, 'WORKER_STATE_DIR', str(tmp_path))
+    monkeypatch.setattr(cvg, '_stats_pid', None)  # anunciarse de nuevo en este directorio
+    return tmp_path
+
+def dead_pid() -> int:
+    p = subprocess.Popen([sys.executable, '-c', 'pass']); p.wait()
+    return p.pid
+
+def test_dead_workers_are_folded_into_retired(state_dir):
+    for pid, renders, recycling in ((dead_pid(), 10, True), (dead_pid(), 5, False)):
+        (state_dir / f'worker-{pid}.json').write_text(json.dumps(
+            {'pid': pid, 'renders': renders, 'aborted': 1, 'max_peak_kb': 0,
+             'max_rss_peak_kb': renders * 100, 'rss_kb': 90000,
+             'recycling': recycling, 'recycled_at': '2026-01-01T00:00:00+00:00' if recycling else None}))
+    r = cvg.app.test_client().get('/stats/memory').json
+    assert [w['pid'] for w in r['workers']] == [os.getpid()]  # before_request lo anuncia
+    retired = r['retired']
+    assert retired['workers'] == 2 and retired['renders'] == 15 and retired['aborted'] == 2
+    assert retired['max_rss_peak_kb'] == 1000
+    assert retired['recycled'] == 1 and retired['last_recycle']['renders'] == 10
+    assert cvg.read_retired_stats() == retired  # segunda lectura: no se cuenta dos veces
+
+@pytest.fixture
+def recycler(state_dir, monkeypatch):
+    """Reciclado activo con os.kill falso: devuelve las señales enviadas."""
+    kills = []
+    real_kill = os.kill
+    monkeypatch.setattr(cvg.os, 'kill', lambda pid, sig: kills.append(sig) if sig else real_kill(pid, sig))
+    monkeypatch.setattr(cvg, 'WORKER_RSS_WATERMARK_MB', 1)  # siempre por encima
+    monkeypatch.setattr(cvg, '_recycling', False)
+    monkeypatch.setitem(cvg.RENDER_STATS, 'renders', cvg.WORKER_RECYCLE_MIN_RENDERS)
+    monkeypatch.setitem(cvg.RENDER_STATS, 'recycling', False)
+    return kills
+
+def slot(state_dir):
+    raw = (state_dir / 'recycle.lock').read_bytes()
+    return json.loads(raw) if raw else None
+
+def test_recycle_waits_for_min_renders(recycler, monkeypatch):
+    monkeypatch.setitem(cvg.RENDER_STATS, 'renders', cvg.WORKER_RECYCLE_MIN_RENDERS - 1)
+    cvg.maybe_recycle_worker()
+    assert recycler == []
+    monkeypatch.setitem(cvg.RENDER_STATS, 'renders', cvg.WORKER_RECYCLE_MIN_RENDERS)
+    cvg.maybe_recycle_worker()
+    assert recycler == [cvg.signal.SIGTERM] and cvg.RENDER_STATS['recycled_at']
+
+def test_recycle_slot_held_until_replacement_announces(recycler, monkeypatch, state_dir):
+    cvg.maybe_recycle_worker()                      # worker A se recicla
+    assert recycler == [cvg.signal.SIGTERM] and slot(state_dir)['pid'] == os.getpid()
+    monkeypatch.setattr(cvg, '_recycling', False)   # worker B, también sobre la marca
+    cvg.maybe_recycle_worker()
+    assert len(recycler) == 1                       # A aún no tiene reemplazo: B espera
+    cvg.release_recycle_slot()
+    assert slot(state_dir)                          # A sigue vivo (terminando): no se libera
+    (state_dir / 'recycle.lock').write_text(json.dumps({'pid': dead_pid(), 'at': time.time()}))
+    monkeypatch.setattr(cvg, '_stats_pid', None)    # proceso nuevo: el reemplazo de A
+    cvg.app.test_client().get('/health')            # atiende su primera petición
+    assert slot(state_dir) is None
+    cvg.maybe_recycle_worker()
+    assert len(recycler) == 2
+
+def test_stale_recycle_slot_expires(recycler, state_dir):
+    stale = time.time() - cvg.WORKER_RECYCLE_SLOT_TIMEOUT - 1
+    (state_dir / 'recycle.lock').write_text(json.dumps({'pid': os.getpid(), 'at': stale}))
+    cvg.maybe_recycle_worker()
+    assert recycler == [cvg.signal.SIGTERM]
+
+# ---------- pico por render y presupuesto ----------
+
+needs_hwm_reset = pytest.mark.skipif(not cvg.reset_peak_rss(), reason='requiere /proc/self/clear_refs (Linux)')
+
+@needs_hwm_reset
+def test_rss_peak_is_per_render_not_end_minus_start(state_dir):
+    with cvg.render_guard():
+        x = b'x' * (64 * cvg.MB); del x
+    assert cvg.RENDER_STATS['last_rss_peak_kb'] > 60 * 1024
+
+@needs_hwm_reset
+def test_photo_preparation_is_measured_and_budgeted(state_dir, monkeypatch):
+    def heavy_photo(url):
+        x = b'x' * (64 * cvg.MB); del x
+        return None
+    monkeypatch.setattr(cvg, 'load_photo', heavy_photo)
+    monkeypatch.setitem(cvg.EXPORTERS, 'pdf', (lambda data: b'%PDF',) + cvg.EXPORTERS['pdf'][1:])
+    data = {'full_name': 'Ana', 'photo_url': 'http://img/p.jpg'}
+    cvg.render_cached('pdf', data)
+    assert cvg.RENDER_STATS['last_rss_peak_kb'] > 60 * 1024
+    monkeypatch.setattr(cvg, 'RENDER_MEM_BUDGET_MB', 16)
+    monkeypatch.setitem(cvg.EXPORTERS, 'pdf', (lambda data: pytest.fail('renderizó tras pasarse'),))
+    with pytest.raises(cvg.RenderBudgetExceeded):
+        cvg.render_cached('pdf', data)
+
+def test_budget_compares_tracemalloc_peak(state_dir, monkeypatch):
+    monkeypatch.setattr(cvg, 'RENDER_TRACEMALLOC', True)
+    monkeypatch.setattr(cvg, 'RENDER_MEM_BUDGET_MB', 0.5)
+    tracemalloc.start()
+    try:
+        with pytest.raises(cvg.RenderBudgetExceeded):
+            with cvg.render_guard():
+                x = bytearray(cvg.MB); del x        # el pico pasa de 0.5 MB aunque ya se liberó
+                cvg.check_render_budget()
+    finally:
+        tracemalloc.stop()
+    assert cvg.RENDER_STATS['last_peak_kb'] >= 1024
@@ -0,0 +1,67 @@
+# test_photos.py
+# -------------------------------------------------------------
+# Derivado de la foto: límites, EXIF, transparencia y caché en disco.
+# Uso: python -m pytest -q
+# -------------------------------------------------------------
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import cv_generator as cvg
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(cvg, 'PHOTO_CACHE_DIR', str(tmp_path))
+    return tmp_path
+
+def encode(im, fmt, **kw):
+    buf = BytesIO(); im.save(buf, fmt, **kw)
+    return buf.getvalue()
+
+def derivative(raw):
+    path = cvg.prepare_photo(raw)
+    assert path and path.endswith('.jpg')
+    return Image.open(path)
+
+def test_decompression_bomb_rejected_from_header(cache_dir):
+    raw = encode(Image.new('1', (5000, 5000)), 'PNG')  # pocos KB, 25 MP
+    assert len(raw) < 100_000
+    assert cvg.prepare_photo(raw) is None
+    assert os.listdir(cache_dir) == []
+
+def test_large_jpeg_allowed_because_draft_decodes_reduced():
+    im = derivative(encode(Image.new('RGB', (6000, 4000), 'green'), 'JPEG'))
+    assert im.size == (cvg.PHOTO_SIDE_PX, cvg.PHOTO_SIDE_PX)
+
+def test_exif_orientation_applied_before_crop():
+    im = Image.new('RGB', (1200, 600), 'red')
+    im.paste('blue', (0, 300, 1200, 600))  # mitad superior roja, inferior azul
+    exif = Image.Exif(); exif[0x0112] = 6   # girar 90°: las franjas pasan a ser verticales
+    out = derivative(encode(im, 'JPEG', exif=exif.tobytes())).convert('RGB')
+    top, bottom = out.getpixel((150, 10)), out.getpixel((150, 590))
+    left, right = out.getpixel((10, 300)), out.getpixel((590, 300))
+    assert top == pytest.approx(bottom, abs=30)
+    assert left[2] > 200 > right[2] or right[2] > 200 > left[2]
+
+def test_transparency_composited_on_white():
+    out = derivative(encode(Image.new('RGBA', (2000, 1500), (255, 0, 0, 0)), 'PNG'))
+    assert out.mode == 'RGB' and min(out.getpixel((300, 300))) > 245
+
+def test_cache_hit_skips_decoding_and_refreshes_mtime(monkeypatch):
+    raw = encode(Image.new('RGB', (800, 800), 'red'), 'JPEG')
+    path = cvg.prepare_photo(raw)
+    os.utime(path, (1, 1))
+    monkeypatch.setattr(cvg.PILImage, 'open', lambda *a: pytest.fail('decodificó en un acierto'))
+    assert cvg.prepare_photo(raw) == path
+    assert os.stat(path).st_mtime > 1
+
+def test_prune_keeps_newest(monkeypatch, cache_dir):
+    monkeypatch.setattr(cvg, 'PHOTO_CACHE_MAX_FILES', 10)
+    for i in range(11):
+        p = cache_dir / f'{i:02d}.jpg'
+        p.write_bytes(b'x'); os.utime(p, (i, i))
+    cvg.prune_photo_cache()
+    assert sorted(os.listdir(cache_dir)) == [f'{i:02d}.jpg' for i in range(2, 11)]